@@ -19,8 +19,16 @@ config = {
         'appdirs>=1.4.0',
         'Click>=6.7',
         'requests>=2.17.3',
-        'six>=1.10.0',
     ],
+    'python_requires': '>=3.5',
+    'extras_require': {
+        'isal': [
+            'isal>=1.0.0',
+        ],
+        'rapidgzip': [
+            'rapidgzip>=0.10.0',
+        ],
+    },
     'entry_points': {
         'console_scripts': [
             'damnode=damnode.cli:main',
@@ -34,13 +42,10 @@ config = {
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 2',
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
 
         # Keep in sync with .travis.yml python versions
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
 
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import click
-import traceback
 from click import ClickException
 from damnode.core import Damnode
 
@@ -15,8 +14,7 @@ class DamnodeCommand(click.Group):
             raise
         except Exception as e:
             if damnode.verbose:
-                traceback.print_exc()
-                raise
+                raise  # the interpreter prints the stack trace
             else:
                 msg = '\n'.join([str(e), 'Provide -v to see full stack trace'])
                 raise ClickException(msg)
@@ -42,10 +40,16 @@ def main(damnode, verbose):
               help='Do not cache downloads')
 @click.option('--cache-dir',
               help='Directory to cache downloads (default: {!r})'.format(Damnode.default_cache_dir))
+@click.option('--no-checksum', is_flag=True,
+              help='Do not verify packages against SHASUMS256.txt')
+@click.option('--parallel', is_flag=True,
+              help='Download packages over parallel HTTP range requests')
+@click.option('-f', '--force', is_flag=True,
+              help='Reinstall even if the same version is already installed')
 @click.option('--prefix', help='Prefix directory to install to (default: {!r})'.format(Damnode.default_prefix))
 @click.argument('hint', required=False)
 @click.pass_obj
-def install(damnode, index, no_cache, cache_dir, prefix, hint):
+def install(damnode, index, no_cache, cache_dir, no_checksum, parallel, force, prefix, hint):
     '''
     Install Node of latest version or from the given HINT, it is detected as follows:
 
@@ -68,6 +72,15 @@ def install(damnode, index, no_cache, cache_dir, prefix, hint):
     if cache_dir:
         damnode.cache_dir = cache_dir
 
+    if no_checksum:
+        damnode.verify_checksum = False
+
+    if parallel:
+        damnode.parallel_download = True
+
+    if force:
+        damnode.force = True
+
     if prefix:
         damnode.prefix = prefix
 
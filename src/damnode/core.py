@@ -3,20 +3,36 @@ import appdirs
 import click
 import errno
 import functools
+import hashlib
+import heapq
+import json
 import os
 import platform
 import re
-import requests
 import shutil
+import stat
 import sys
 import tarfile
 import tempfile
+import threading
+import time
 import zipfile
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
 from fnmatch import fnmatch
+from html import unescape
 from os import path as osp
-from six.moves.html_parser import HTMLParser
-from six.moves.urllib import parse as urlparse
+from urllib import parse as urlparse
+
+try:
+    from isal import igzip  # optional, faster gzip decompression
+except ImportError:
+    igzip = None
+
+try:
+    import rapidgzip  # optional, parallel gzip decompression of files
+except ImportError:
+    rapidgzip = None
 
 
 def cached_property(method):
@@ -32,6 +48,78 @@ def cached_property(method):
     return property(wrapped)
 
 
+def makedirs(dirname):
+    try:
+        os.makedirs(dirname)
+    except EnvironmentError as e:
+        if e.errno == errno.EEXIST:
+            pass
+        else:
+            raise
+
+
+def move_tree(src_dir, dst_dir):
+    for dirname, subdirs, filenames in os.walk(src_dir):
+        out_dir = osp.normpath(osp.join(dst_dir, osp.relpath(dirname, src_dir)))
+        makedirs(out_dir)
+
+        # Symlinks to directories are listed as subdirs but never walked into
+        links = [n for n in subdirs if osp.islink(osp.join(dirname, n))]
+
+        for name in filenames + links:
+            os.replace(osp.join(dirname, name), osp.join(out_dir, name))
+
+
+def hash_file(filename, chunk_size):
+    hasher = hashlib.sha256()
+
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+
+    return hasher
+
+
+def load_json(filename):
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except EnvironmentError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        else:
+            raise
+    except ValueError:
+        return None  # corrupted, will be overwritten
+
+
+def save_json(filename, data):
+    dirname = osp.dirname(filename)
+    makedirs(dirname)
+    temp_fd, temp_file = tempfile.mkstemp(prefix='{}.'.format(osp.basename(filename)), dir=dirname)
+
+    try:
+        with os.fdopen(temp_fd, 'w') as f:
+            json.dump(data, f)
+    except:
+        os.remove(temp_file)
+        raise
+    else:
+        os.replace(temp_file, filename)
+
+
+def preallocate(fd, size):
+    # Best effort, posix_fallocate is missing on Windows and macOS and some
+    # file systems do not support it
+    if not hasattr(os, 'posix_fallocate'):
+        return
+
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except EnvironmentError:
+        pass
+
+
 class Damnode(object):
     def _get_default_cache_dir():
         app_name = osp.splitext(osp.basename(__file__))[0]
@@ -44,16 +132,35 @@ class Damnode(object):
 
     _package_re = re.compile(r'^node-(?P<version>[^-]+)-(?P<platform>[^-]+)-(?P<arch>[^\.]+)\.(?P<format>.+)$')
     _version_re = re.compile(r'^v?(?P<major>\d+)(\.(?P<minor>\d+))?(\.(?P<build>\d+))?$')
+    _arch_patterns = [(re.compile(patt), arch) for patt, arch in [
+        (r'^i686-64$', 'x64'),
+        (r'^i686', 'x86'),
+        (r'^x86_64$', 'x64'),
+        (r'^amd64$', 'x64'),
+        (r'^ppc$', 'ppc64'),
+        (r'^powerpc$', 'ppc64'),
+        (r'^aarch64$', 'arm64'),
+        (r'^s390', 's390x'),
+    ]]
 
     def __init__(self):
         self.verbose = False
         self.enable_cache = True
         self.cache_dir = self.default_cache_dir
-        self.download_chunk_size = 10 * 1024
+        self.download_chunk_size = 256 * 1024
+        self.spool_max_size = 64 * 1024 * 1024
+        self.max_cache_size = 500 * 1024 * 1024
+        self.not_found_ttl = 10 * 60
+        self.rapidgzip_min_size = 8 * 1024 * 1024
         self.package_suffixes = ['.gz', '.msi', '.pkg', '.xz', '.zip']
         self.url_prefixes = ['http://', 'https://', 'file://']
         self.prefix = self.default_prefix
         self.check_sys_arch = False
+        self.max_workers = 4
+        self.parallel_download = False
+        self.parallel_min_size = 8 * 1024 * 1024
+        self.verify_checksum = True
+        self.force = False
         self._indices = [self.default_index]
 
     def info(self, msg):
@@ -65,6 +172,10 @@ class Damnode(object):
 
     def install(self, hint):
         if hint and self.has_package_suffix(hint):
+            if not self.force and osp.basename(hint) == self.get_installed_package():
+                self.info('{!r} is already installed, provide --force to reinstall'.format(osp.basename(hint)))
+                return
+
             self.download_install_package(hint)
             return
 
@@ -78,6 +189,10 @@ class Damnode(object):
         else:
             version = None
 
+        if not self.force and version is not None and None not in version and self._is_version_installed(version):
+            self.info('Node v{}.{}.{} is already installed, provide --force to reinstall'.format(*version))
+            return
+
         self.debug('indices = {!r}'.format(indices))
         self.debug('version = {!r}'.format(version))
         self.debug('system = {!r}'.format(self.system))
@@ -91,6 +206,33 @@ class Damnode(object):
                 self.download_install_package(link)
                 return
 
+    def get_installed_package(self):
+        try:
+            with open(self.installed_file, 'r') as f:
+                return f.read().strip() or None
+        except EnvironmentError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            else:
+                raise
+
+    def _is_version_installed(self, version):
+        package = self.get_installed_package()
+
+        if not package:
+            return False
+
+        try:
+            ver, system, arch, fmt = self.parse_package_name(package)
+        except ValueError:
+            return False
+
+        return ver == version and system == self.system and arch == self.architecture
+
+    @property
+    def installed_file(self):
+        return osp.join(self.prefix, '.damnode-version')
+
     def uninstall(self):
         self.info('TODO')
 
@@ -101,43 +243,100 @@ class Damnode(object):
         self._indices.insert(0, index)
 
     def find_package(self, index, version):
+        if version is not None and None not in version:
+            # Indices lay versions out as v<major>.<minor>.<build>/, try it
+            # before reading and parsing the whole index
+            version_link = self._join_link(index, 'v{}.{}.{}/'.format(*version))
+
+            if version_link:
+                link = self._find_package_link(self.read_links(version_link), version)
+
+                if link:
+                    return link
+
         links = self.read_links(index)
         verlinks = []
 
+        # Most index links are not versions, filter them before parsing
+        # rather than raising and catching ValueError for each
+        version_re = self._version_re
+
         for link in links:
             ver_str = osp.basename(osp.abspath(link))  # without end /
-            try:
-                ver = self.parse_version(ver_str)
-            except ValueError:
-                pass
-            else:
-                verlinks.append((ver, link))
 
-        verlinks = reversed(verlinks)
-        match = lambda a, b: a is None or a == b
-        version_link = None
+            if version_re.match(ver_str):
+                verlinks.append((self.parse_version(ver_str), link))
 
-        for ver, link in verlinks:
-            if version is None or match(version[0], ver[0]) and match(version[1], ver[1]) and match(version[2], ver[2]):
-                version_link = link
-                break
+        if version is None:
+            matched = verlinks
+        else:
+            match = lambda ver: all(a is None or a == b for a, b in zip(version, ver))
+            matched = [(ver, link) for ver, link in verlinks if match(ver)]
 
-        if not version_link:
-            return
+        # Index order is not version order (v10 lists before v9), pick the
+        # newest few without sorting everything
+        version_key = lambda verlink: tuple(-1 if v is None else v for v in verlink[0])
+        candidates = heapq.nlargest(self.max_workers, matched, key=version_key)
+
+        if not candidates:
+            return None
+
+        # Fetch candidate version pages concurrently, older versions are only
+        # used when newer ones have no package for this system
+        with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+            version_links = [link for ver, link in candidates]
 
-        package_links = self.read_links(version_link)
+            for (ver, _), package_links in zip(candidates, executor.map(self.read_links, version_links)):
+                link = self._find_package_link(package_links, ver)
+
+                if link:
+                    return link
+
+        return None
+
+    def _find_package_link(self, package_links, version):
+        # Resolve the cached properties once rather than per link
+        expected = (version, self.system, self.architecture, self.archive_format)
+        parse_package_name = self.parse_package_name
+        package_links = package_links or []
+
+        # A fully specified version names exactly one package, compare names
+        # before falling back to parsing every link
+        if None not in version:
+            name = 'node-v{}.{}.{}-{}-{}.{}'.format(*(version + expected[1:]))
+
+            for link in package_links:
+                if osp.basename(link) == name:
+                    return link
 
         for link in package_links:
+            name = osp.basename(link)
+
+            # Skip SHASUMS, docs, etc without going through ValueError
+            if not name.startswith('node-') or not self.has_package_suffix(name):
+                continue
+
             try:
-                ver, system, arch, fmt = self.parse_package_name(osp.basename(link))
+                package = parse_package_name(name)
             except ValueError:
                 pass
             else:
-                if (version is None or ver == version) and system == self.system and arch == self.architecture and self.archive_format == fmt:
+                if package == expected:
                     return link
 
         return None
 
+    def _join_link(self, index, name):
+        if self.is_url(index):
+            if not index.endswith('/'):
+                index += '/'
+
+            return urlparse.urljoin(index, name)
+
+        if osp.isdir(index):
+            return osp.join(index, name.rstrip('/'))
+
+        return None
 
     def read_links(self, link):
         self.info('Reading links from {!r}'.format(link))
@@ -148,21 +347,21 @@ class Damnode(object):
         read_html = lambda h: HtmlLinksParser(link, h).links
 
         if self.is_url(link):
-            resp = requests.get(link)
-            return read_html(resp.text)
+            return self._read_url_links(link)
 
         try:
-            entries = os.listdir(link)
+            # DirEntry.path is already joined with link
+            entries = [e.path for e in os.scandir(link)]
         except EnvironmentError as e:
             if e.errno in (errno.ENOENT, errno.ENOTDIR):
                 pass
             else:
                 raise
         else:
-            return sorted([osp.join(link, e) for e in entries])  # sort from file system
+            return sorted(entries)  # sort from file system
 
         try:
-            with open(link, 'r') as f:
+            with open(link, 'rb') as f:
                 html = f.read()
         except EnvironmentError as e:
             if e.errno  == errno.ENOENT:
@@ -172,9 +371,139 @@ class Damnode(object):
         else:
             return read_html(html)
 
+    def _read_url_links(self, url):
+        cache_file = osp.join(self.cache_dir, 'links',
+                              '{}.json'.format(hashlib.sha1(url.encode('utf-8')).hexdigest()))
+        cached = load_json(cache_file) if self.enable_cache else None
+        headers = {}
+
+        if cached and 'not_found' in cached:
+            if time.time() - cached['not_found'] < self.not_found_ttl:
+                self.debug('{!r} was not found recently, skipping'.format(url))
+                return []
+
+            cached = None
+
+        if cached:
+            # Not every mirror sends an ETag, fall back to the modification time
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        resp = self.session.get(url, headers=headers)
+
+        if resp.status_code == 304 and cached:
+            self.debug('Links of {!r} not modified, using {!r}'.format(url, cache_file))
+            return cached['links']
+
+        if resp.status_code == 404:
+            # Missing version directories are probed repeatedly, remember them
+            # for a while instead of parsing the error page
+            if self.enable_cache:
+                save_json(cache_file, {'not_found': time.time()})
+
+            return []
+
+        links = HtmlLinksParser(url, resp.content).links
+        etag = resp.headers.get('etag')
+        last_modified = resp.headers.get('last-modified')
+
+        if self.enable_cache and resp.ok and (etag or last_modified):
+            self.debug('Caching links of {!r} to {!r}'.format(url, cache_file))
+            save_json(cache_file, {'etag': etag, 'last_modified': last_modified, 'links': links})
+
+        return links
+
     def download_install_package(self, link):
+        # Extract into a staging directory on the same file system and move the
+        # files over only once the package is complete and its checksum
+        # verified, a bad download leaves the prefix untouched
+        makedirs(self.prefix)
+        staging_dir = tempfile.mkdtemp(prefix='.damnode-', dir=self.prefix)
+
+        try:
+            self._download_install_package(link, staging_dir)
+            # Forget the previous install only now, a failed download leaves
+            # it intact but a failure while moving files leaves a mixed tree
+            if osp.isfile(self.installed_file):
+                os.remove(self.installed_file)
+
+            self.debug('Moving {!r} to {!r}'.format(staging_dir, self.prefix))
+            move_tree(staging_dir, self.prefix)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        with open(self.installed_file, 'w') as f:
+            f.write(osp.basename(link))
+
+    def _download_install_package(self, link, prefix):
+        if self.is_url(link) and not self.parallel_download:
+            if not self.enable_cache:
+                self.stream_install_package(link, prefix=prefix)
+                return
+
+            name = osp.basename(link)
+
+            # tar.gz can be extracted as it downloads, zip needs the whole file
+            if name.endswith('.tar.gz') and not osp.isfile(osp.join(self.cache_dir, name)):
+                self.stream_install_package(link, cache=True, prefix=prefix)
+                return
+
         with self.download_package(link) as filename:
-            self.install_package(filename)
+            self.install_package(filename, prefix=prefix)
+
+    def stream_install_package(self, link, cache=False, prefix=None):
+        name = osp.basename(link)
+        self.parse_package_name(name)
+        self.info('Streaming {!r}'.format(link))
+
+        checksum = self.get_package_checksum(link)
+        cache_out = None
+        resp = self.session.get(link, stream=True)
+
+        try:
+            resp.raise_for_status()
+            resp.raw.decode_content = True
+
+            # Only after the request went through, a failed GET leaves no
+            # temp file behind
+            if cache:
+                makedirs(self.cache_dir)
+                temp_fd, temp_file = tempfile.mkstemp(prefix='{}.download-'.format(name),
+                                                      dir=self.cache_dir)
+                cache_out = os.fdopen(temp_fd, 'wb')
+                self.debug('Saving to temp file {!r}'.format(temp_file))
+
+            with self._open_resp_stream(resp) as stream:
+                if cache_out:
+                    stream = TeeReader(stream, cache_out)
+
+                stream = HashingReader(stream)
+                self.install_package(name, stream, prefix)
+
+                # tarfile stops at the end-of-archive marker, read the padding
+                # too so that the whole file is hashed and cached
+                while stream.read(self.download_chunk_size):
+                    pass
+
+            self._verify_length(link, resp, stream.size)
+            self._verify_checksum(link, checksum, stream.hexdigest())
+        except:
+            if cache_out:
+                cache_out.close()
+                os.remove(temp_file)
+            raise
+        else:
+            if cache_out:
+                cache_out.close()
+                cached_file = osp.join(self.cache_dir, name)
+                self.debug('Rename {!r} to {!r}'.format(temp_file, cached_file))
+                os.replace(temp_file, cached_file)
+                self.prune_cache(cached_file)
+        finally:
+            resp.close()
 
     @contextmanager
     def download_package(self, link):
@@ -184,39 +513,201 @@ class Damnode(object):
         with self._ensure_cache_dir():
             cached_file = osp.join(self.cache_dir, name)
 
-            if osp.isfile(cached_file):
+            # One stat for both the cache hit check and the access time bump
+            try:
+                cached_stat = os.stat(cached_file)
+            except EnvironmentError as e:
+                if e.errno == errno.ENOENT:
+                    cached_stat = None
+                else:
+                    raise
+
+            if cached_stat and stat.S_ISREG(cached_stat.st_mode):
                 self.info('Using cached {!r}'.format(cached_file))
+                # Most recently used, pruned last. Keep mtime, the file may be a
+                # hard link to a local package. Only a hint, setting times needs
+                # ownership and a shared read-only cache must still work
+                try:
+                    os.utime(cached_file, (time.time(), cached_stat.st_mtime))
+                except EnvironmentError:
+                    pass
                 yield cached_file
             elif self.is_url(link):
+                # Before mkstemp, the fd is only closed once fdopen owns it
+                checksum = self.get_package_checksum(link)
                 temp_fd, temp_file = tempfile.mkstemp(prefix='{}.download-'.format(name),
                                                       dir=self.cache_dir)
                 try:
                     self.info('Downloading {!r}'.format(link))
                     self.debug('Downloading to temp file {!r}'.format(temp_file))
+                    hasher = hashlib.sha256()
+
+                    with os.fdopen(temp_fd, 'wb') as f:
+                        if self.parallel_download and self._download_ranges(link, temp_file):
+                            # Ranges arrive out of order, hash the finished file
+                            hasher = hash_file(temp_file, self.download_chunk_size) if checksum else None
+                        else:
+                            # Close so that the connection goes back to the session pool
+                            with closing(self.session.get(link, stream=True)) as resp:
+                                resp.raise_for_status()
 
-                    with open(temp_file, 'wb') as f:
-                        resp = requests.get(link, stream=True)
+                                try:
+                                    preallocate(f.fileno(), int(resp.headers.get('content-length', '')))
+                                except ValueError:
+                                    pass
 
-                        for chunk in self._iter_resp_chunks(resp):
-                            f.write(chunk)
+                                for chunk in self._iter_resp_chunks(resp):
+                                    f.write(chunk)
+                                    hasher.update(chunk)
+
+                                # Drop the preallocated tail if the body came up short
+                                f.truncate()
+
+                    if hasher:
+                        self._verify_checksum(link, checksum, hasher.hexdigest())
 
                     self.debug('Rename {!r} to {!r}'.format(temp_file, cached_file))
                 except:
                     os.remove(temp_file)
                     raise
                 else:
-                    os.rename(temp_file, cached_file)
+                    os.replace(temp_file, cached_file)
 
+                self.prune_cache(cached_file)
                 yield cached_file
             else:
                 self.info('Copying {!r}'.format(link))
-                shutil.copyfile(link, cached_file)
-                shutil.copystat(link, cached_file)
+
+                try:
+                    # Cached files are only ever replaced, never written in
+                    # place, so sharing the source inode is safe
+                    os.link(link, cached_file)
+                except EnvironmentError:
+                    # Different file system or no hard link support
+                    shutil.copyfile(link, cached_file)
+                    shutil.copystat(link, cached_file)
+                self.prune_cache(cached_file)
                 yield cached_file
 
-    def install_package(self, package_file):
+    def get_package_checksum(self, link):
+        if not self.verify_checksum or not self.is_url(link):
+            return None
+
+        shasums_link = urlparse.urljoin(link, 'SHASUMS256.txt')
+        resp = self.session.get(shasums_link)
+
+        if not resp.ok:
+            self.debug('No checksums at {!r} (HTTP {})'.format(shasums_link, resp.status_code))
+            return None
+
+        name = osp.basename(link)
+
+        for line in resp.text.splitlines():
+            parts = line.split()
+
+            if len(parts) == 2 and parts[1] == name:
+                return parts[0].lower()
+
+        self.debug('No checksum of {!r} in {!r}'.format(name, shasums_link))
+        return None
+
+    def _verify_checksum(self, link, expected, actual):
+        if expected is None:
+            return
+
+        if expected != actual:
+            raise ValueError('Checksum mismatch for {!r}, expected SHA-256 {} but got {}'.format(
+                link, expected, actual))
+
+        self.debug('Checksum of {!r} verified'.format(link))
+
+    def _verify_length(self, link, resp, actual):
+        # tarfile takes a truncated gzip stream for the end of the archive, so
+        # a dropped connection must be caught here
+        if resp.headers.get('content-encoding'):
+            return  # Content-Length counts the encoded bytes
+
+        try:
+            expected = int(resp.headers.get('content-length', ''))
+        except ValueError:
+            return
+
+        if expected != actual:
+            raise ValueError('Incomplete download of {!r}, got {} of {} bytes'.format(
+                link, actual, expected))
+
+    def _download_ranges(self, link, filename):
+        resp = self.session.head(link, allow_redirects=True)
+
+        try:
+            size = int(resp.headers.get('content-length', ''))
+        except ValueError:
+            return False
+
+        if resp.headers.get('accept-ranges') != 'bytes' or size < self.parallel_min_size:
+            return False
+
+        part_size = -(-size // self.max_workers)
+        ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+        self.debug('Downloading {} bytes in {} ranges'.format(size, len(ranges)))
+        # Ranges are written at their offsets, set the final size and reserve
+        # the blocks up front, truncate alone leaves a sparse file
+        with open(filename, 'r+b') as f:
+            f.truncate(size)
+            preallocate(f.fileno(), size)
+
+        lock = threading.Lock()
+
+        with click.progressbar(length=size) as progress:
+            def update(length):
+                with lock:
+                    progress.update(length)
+
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [executor.submit(self._download_range, link, filename, start, end, update)
+                           for start, end in ranges]
+                results = [f.result() for f in futures]
+
+        if not all(results):
+            self.debug('Server ignored range requests, downloading in one stream')
+            return False
+
+        return True
+
+    def _download_range(self, link, filename, start, end, update):
+        headers = {'Range': 'bytes={}-{}'.format(start, end)}
+        resp = self.session.get(link, headers=headers, stream=True)
+
+        try:
+            if resp.status_code != 206:
+                return False
+
+            written = 0
+
+            # Each range opens its own handle, writes land at disjoint offsets
+            with open(filename, 'r+b') as f:
+                f.seek(start)
+
+                for chunk in resp.iter_content(chunk_size=self.download_chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+                    update(len(chunk))
+        finally:
+            resp.close()
+
+        # The file is preallocated, a short range would leave zeros behind
+        if written != end - start + 1:
+            raise ValueError('Incomplete download of {!r}, got {} of {} bytes at offset {}'.format(
+                link, written, end - start + 1, start))
+
+        return True
+
+    def install_package(self, package_file, fileobj=None, prefix=None):
         self.info('Installing {!r}'.format(package_file))
 
+        if prefix is None:
+            prefix = self.prefix
+
         version, platf, arch, fmt = self.parse_package_name(osp.basename(package_file))
 
         if self.check_sys_arch:
@@ -235,19 +726,21 @@ class Damnode(object):
                     return True
             return False
 
-        for out_file, extract in self.iter_package_members(package_file):
+        for out_file, extract in self.iter_package_members(package_file, fileobj):
             if not osp.dirname(out_file) and not is_root_file_allowed(out_file):
                 self.debug('Skip {!r}'.format(out_file))
             else:
-                self.debug('Install {!r}'.format(osp.join(self.prefix, out_file)))
-                extract(self.prefix)
+                self.debug('Install {!r}'.format(osp.join(prefix, out_file)))
+                extract(prefix)
 
-    def iter_package_members(self, package_file):
+    def iter_package_members(self, package_file, fileobj=None):
         tgz_suffix = '.tar.gz'
         zip_suffix = '.zip'
 
         def iter_tgz():
-            with tarfile.open(package_file) as ar:
+            with self._open_tgz(package_file, fileobj) as ar:
+                # Buffer used to copy member data out (Python 3.8+, 16 KiB by default)
+                ar.copybufsize = self.download_chunk_size
                 base_dir = osp.basename(package_file[:-len(tgz_suffix)])
 
                 for member in ar:
@@ -256,7 +749,15 @@ class Damnode(object):
                         yield member.name, lambda p: ar.extract(member, p)
 
         def iter_zip():
-            with zipfile.ZipFile(package_file) as ar:
+            if fileobj is None:
+                source = open(package_file, 'rb')
+            else:
+                # ZipFile needs to seek to the central directory at the end
+                source = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size)
+                shutil.copyfileobj(fileobj, source, self.download_chunk_size)
+                source.seek(0)
+
+            with source, zipfile.ZipFile(source) as ar:
                 base_dir = osp.basename(package_file[:-len(zip_suffix)])
 
                 for info in ar.infolist():
@@ -275,17 +776,66 @@ class Damnode(object):
 
         return ValueError
 
+    @contextmanager
+    def _open_tgz(self, package_file, fileobj=None):
+        if fileobj is None:
+            if rapidgzip is not None and osp.getsize(package_file) >= self.rapidgzip_min_size:
+                # Seekable file on disk, inflate it on all cores, small files
+                # do not make up for the thread start up
+                self.debug('Decompressing with rapidgzip')
+
+                with closing(rapidgzip.open(package_file, parallelization=os.cpu_count() or 1)) as gz, \
+                        tarfile.open(fileobj=gz, mode='r|') as ar:
+                    yield ar
+            elif igzip is None:
+                with tarfile.open(package_file, 'r:gz') as ar:
+                    yield ar
+            else:
+                with open(package_file, 'rb') as f, self._open_tgz(package_file, f) as ar:
+                    yield ar
+        elif igzip is None:
+            # Streaming mode, members must be extracted in order. Keep the
+            # default bufsize, _Stream copies its leftover buffer on every
+            # read, a large one makes each 512 byte header read expensive
+            with tarfile.open(fileobj=fileobj, mode='r|gz') as ar:
+                yield ar
+        else:
+            self.debug('Decompressing with isal')
+
+            with igzip.IGzipFile(fileobj=fileobj, mode='rb') as gz, \
+                    tarfile.open(fileobj=gz, mode='r|') as ar:
+                yield ar
+
+    def prune_cache(self, keep=None):
+        if not self.enable_cache or self.max_cache_size is None:
+            return
+
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir)
+                       if entry.is_file() and self.has_package_suffix(entry.name)]
+        except EnvironmentError as e:
+            if e.errno == errno.ENOENT:
+                return
+            else:
+                raise
+
+        entries = [(entry.stat(), entry.path) for entry in entries]
+        total_size = sum(st.st_size for st, _ in entries)
+
+        # Least recently used first, cache hits bump the access time
+        for st, path in sorted(entries, key=lambda i: i[0].st_atime):
+            if total_size <= self.max_cache_size:
+                break
+
+            if path != keep:
+                self.debug('Prune {!r} from cache'.format(path))
+                os.remove(path)
+                total_size -= st.st_size
+
     @contextmanager
     def _ensure_cache_dir(self):
         if self.enable_cache:
-            try:
-                os.makedirs(self.cache_dir)
-            except EnvironmentError as e:
-                if e.errno == errno.EEXIST:
-                    pass
-                else:
-                    raise
-
+            makedirs(self.cache_dir)
             yield
             return
 
@@ -297,6 +847,17 @@ class Damnode(object):
             shutil.rmtree(self.cache_dir)
             self.cache_dir = orig_cache_dir
 
+    @contextmanager
+    def _open_resp_stream(self, resp):
+        try:
+            content_length = int(resp.headers.get('content-length', ''))
+        except ValueError:
+            # No Content-Length, no progress
+            yield resp.raw
+        else:
+            with click.progressbar(length=content_length) as progress:
+                yield ProgressReader(resp.raw, progress)
+
     def _iter_resp_chunks(self, resp):
         chunk_size = self.download_chunk_size
         try:
@@ -310,21 +871,15 @@ class Damnode(object):
             with click.progressbar(length=content_length) as progress:
                 for chunk in resp.iter_content(chunk_size=chunk_size):
                     yield chunk
-                    progress.update(chunk_size)
+                    progress.update(len(chunk))
 
     def is_url(self, link):
-        for prefix in self.url_prefixes:
-            if link.startswith(prefix):
-                return True
-
-        return False
+        # url_prefixes is public and may be changed, so convert per call
+        return link.startswith(tuple(self.url_prefixes))
 
     def has_package_suffix(self, link):
-        for suffix in self.package_suffixes:
-            if link.endswith(suffix):
-                return True
-
-        return False
+        # package_suffixes is public and may be changed, so convert per call
+        return link.endswith(tuple(self.package_suffixes))
 
     def parse_package_name(self, name):
         if not self.has_package_suffix(name):
@@ -353,6 +908,22 @@ class Damnode(object):
         opt_int = lambda i: None if i is None else int(i)
         return int(m.group('major')), opt_int(m.group('minor')), opt_int(m.group('build'))
 
+    @cached_property
+    def session(self):
+        # requests is imported here so that --help and argument errors do not
+        # pay for importing it
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.packages.urllib3.util.retry import Retry
+
+        # Keep-alive connections are reused across index pages and downloads
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retries)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     @cached_property
     def system(self):
         return self._get_system(platform.system())
@@ -375,48 +946,87 @@ class Damnode(object):
         return self._get_compatible_arch(platform.machine(), platform.processor())
 
     def _get_compatible_arch(self, machine, processor):
-        patterns = [
-            (r'^i686-64$', 'x64'),
-            (r'^i686', 'x86'),
-            (r'^x86_64$', 'x64'),
-            (r'^amd64$', 'x64'),
-            (r'^ppc$', 'ppc64'),
-            (r'^powerpc$', 'ppc64'),
-            (r'^aarch64$', 'arm64'),
-            (r'^s390', 's390x'),
-        ]
         simpify = lambda v: '' if v is None else v.lower()
         machine = simpify(machine)
         processor = simpify(processor)
 
-        for patt, arch in patterns:
-            pattc = re.compile(patt)
-
+        for pattc, arch in self._arch_patterns:
             if pattc.match(machine) or pattc.match(processor):
                 return arch
 
         return machine
 
 
-class HtmlLinksParser(HTMLParser):
+class ProgressReader(object):
+    def __init__(self, fileobj, progress):
+        self.fileobj = fileobj
+        self.progress = progress
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.progress.update(len(data))
+        return data
+
+    def readinto(self, buf):
+        size = self.fileobj.readinto(buf)
+        self.progress.update(size)
+        return size
+
+
+class HashingReader(object):
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        self.size += len(data)
+        return data
+
+    def readinto(self, buf):
+        size = self.fileobj.readinto(buf)
+        self.hasher.update(memoryview(buf)[:size])
+        self.size += size
+        return size
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+class TeeReader(object):
+    def __init__(self, fileobj, out):
+        self.fileobj = fileobj
+        self.out = out
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.out.write(data)
+        return data
+
+    def readinto(self, buf):
+        size = self.fileobj.readinto(buf)
+        self.out.write(memoryview(buf)[:size])
+        return size
+
+
+class HtmlLinksParser(object):
+    # Node indices are plain autoindex pages, scanning for <a href> is enough
+    # Matches bytes, so only the hrefs are decoded rather than the whole page
+    _link_re = re.compile(br'''<a\s[^>]*?\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+
     def __init__(self, url, html):
-        HTMLParser.__init__(self)
         self.links = []
         self.url = url
-        self.feed(html)
-
-    def handle_starttag(self, tag, attrs):
-        if tag.lower() != 'a':
-            return
-
-        for name, value in attrs:
-            if name.lower() != 'href':
-                continue
 
-            value = value.strip()
+        for m in self._link_re.finditer(html):
+            # Not every mirror serves UTF-8, never fail on a stray byte
+            value = (m.group(1) or m.group(2) or m.group(3) or b'').decode('utf-8', 'replace').strip()
 
             if not value:
                 continue
 
-            path = urlparse.urljoin(self.url, value)
+            # HTMLParser used to resolve entities such as &amp; in attributes
+            path = urlparse.urljoin(self.url, unescape(value))
             self.links.append(path)
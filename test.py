@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
+import gzip
+import hashlib
+import io
+import os
 import shutil
+import tarfile
 import tempfile
+import zipfile
 from contextlib import contextmanager
-from unittest import TestCase, skip
+from unittest import TestCase, mock, skip
 from damnode import Damnode
 from os import path as osp
 
@@ -39,6 +45,68 @@ class LinkTest(TestCase):
         d = create_damnode()
         self.assertEqual(['node-v6.xz'], d.read_links('node-v6.xz'))
 
+    def test_read_links_not_modified(self):
+        with temp_dir() as cache_dir:
+            url = 'https://nodejs.org/dist/'
+            d = Damnode()
+            d.cache_dir = cache_dir
+            d._session = FakeSession([
+                FakeResponse(200, '<a href="v8.2.1/">v8.2.1/</a>', {'etag': '"abc"'}),
+                FakeResponse(304),
+            ])
+            links = d.read_links(url)
+            self.assertEqual(['https://nodejs.org/dist/v8.2.1/'], links)
+            self.assertEqual(links, d.read_links(url))
+            self.assertEqual({'If-None-Match': '"abc"'}, d._session.requests[1]['headers'])
+
+    def test_read_links_not_modified_since(self):
+        with temp_dir() as cache_dir:
+            url = 'https://nodejs.org/dist/'
+            last_modified = 'Mon, 31 Jul 2017 23:29:51 GMT'
+            d = Damnode()
+            d.cache_dir = cache_dir
+            d._session = FakeSession([
+                FakeResponse(200, '<a href="v8.2.1/">v8.2.1/</a>', {'last-modified': last_modified}),
+                FakeResponse(304),
+            ])
+            links = d.read_links(url)
+            self.assertEqual(links, d.read_links(url))
+            self.assertEqual({'If-Modified-Since': last_modified}, d._session.requests[1]['headers'])
+
+    def test_read_links_not_found(self):
+        with temp_dir() as cache_dir:
+            url = 'https://nodejs.org/dist/v0.0.0/'
+            d = Damnode()
+            d.cache_dir = cache_dir
+            d._session = FakeSession([
+                FakeResponse(404, '<a href="/">Home</a>'),
+                FakeResponse(200, '<a href="SHASUMS256.txt">SHASUMS256.txt</a>'),
+            ])
+            self.assertEqual([], d.read_links(url))
+            self.assertEqual([], d.read_links(url))
+            self.assertEqual(1, len(d._session.requests))
+
+            d.not_found_ttl = 0
+            self.assertEqual(['https://nodejs.org/dist/v0.0.0/SHASUMS256.txt'], d.read_links(url))
+
+    def test_read_links_non_utf8(self):
+        d = Damnode()
+        d.enable_cache = False
+        d._session = FakeSession([
+            FakeResponse(200, content=b'<a href="caf\xe9/">caf\xe9/</a> <a href="v8.2.1/">v8.2.1/</a>'),
+        ])
+        links = d.read_links('https://nodejs.org/dist/')
+        self.assertEqual(['https://nodejs.org/dist/caf\ufffd/', 'https://nodejs.org/dist/v8.2.1/'], links)
+
+    def test_read_links_entities(self):
+        d = Damnode()
+        d.enable_cache = False
+        d._session = FakeSession([
+            FakeResponse(200, '<a href="a&amp;b/">a&amp;b/</a> <a href=\'c&#47;\'>c/</a>'),
+        ])
+        links = d.read_links('https://nodejs.org/dist/')
+        self.assertEqual(['https://nodejs.org/dist/a&b/', 'https://nodejs.org/dist/c/'], links)
+
     # TODO: thorough test
     def test_find_package(self):
         d = TestDamnode()
@@ -52,11 +120,42 @@ class LinkTest(TestCase):
         exp_link = data_dir('find-package-index/v8.2.1/node-v8.2.1-linux-x64.tar.gz')
         self.assertEqual(exp_link, link)
 
+    def test_find_exact_version_package(self):
+        d = TestDamnode()
+        d._session = FakeSession([
+            FakeResponse(200, '<a href="node-v8.1.2-linux-x64.tar.gz">node-v8.1.2-linux-x64.tar.gz</a>'),
+        ])
+        link = d.find_package('https://nodejs.org/dist', (8, 1, 2))
+        self.assertEqual('https://nodejs.org/dist/v8.1.2/node-v8.1.2-linux-x64.tar.gz', link)
+        self.assertEqual(['https://nodejs.org/dist/v8.1.2/'], [r['url'] for r in d._session.requests])
+
+    def test_find_partial_version_package(self):
+        d = TestDamnode()
+        link = d.find_package(data_dir('find-package-index'), (7, None, None))
+        exp_link = data_dir('find-package-index/v7.10.1/node-v7.10.1-linux-x64.tar.gz')
+        self.assertEqual(exp_link, link)
+
+    def test_find_latest_package_by_version(self):
+        with temp_dir() as index:
+            touch(osp.join(index, 'v10.0.0', 'node-v10.0.0-linux-x64.tar.gz'))
+            touch(osp.join(index, 'v9.11.2', 'node-v9.11.2-linux-x64.tar.gz'))
+            d = TestDamnode()
+            link = d.find_package(index, None)
+            self.assertEqual(osp.join(index, 'v10.0.0', 'node-v10.0.0-linux-x64.tar.gz'), link)
+
+    def test_find_older_package(self):
+        with temp_dir() as index:
+            touch(osp.join(index, 'v8.2.1', 'node-v8.2.1-win-x64.zip'))
+            touch(osp.join(index, 'v7.10.1', 'node-v7.10.1-linux-x64.tar.gz'))
+            d = TestDamnode()
+            link = d.find_package(index, None)
+            self.assertEqual(osp.join(index, 'v7.10.1', 'node-v7.10.1-linux-x64.tar.gz'), link)
+
     def test_find_remote_package(self):
         d = TestDamnode()
         link = d.find_package(TestDamnode.default_index, (7, 10, 1))
         self.assertIsNotNone(link)
-        self.assertRegexpMatches(link, r'node-v7\.10\.1-linux-x64\.tar\.gz$')
+        self.assertRegex(link, r'node-v7\.10\.1-linux-x64\.tar\.gz$')
 
 
 class NameTest(TestCase):
@@ -75,7 +174,7 @@ class NameTest(TestCase):
     def test_parse_package_name(self):
         d = Damnode()
 
-        self.assertRaisesRegexp(
+        self.assertRaisesRegex(
             ValueError,
             r"Invalid package name 'node.*', suffix must be one of \[",
             d.parse_package_name, 'node-v8.1.2-win-x64.superzip')
@@ -83,7 +182,7 @@ class NameTest(TestCase):
         self.assertEqual(((8, 1, 2), 'linux', 'x64', 'tar.gz'),
                           d.parse_package_name('node-v8.1.2-linux-x64.tar.gz'))
 
-        self.assertRaisesRegexp(
+        self.assertRaisesRegex(
             ValueError,
             r"Invalid package name 'foobar.*', it does not match regex \^node-",
             d.parse_package_name, 'foobar-v8.1.2-darwin-x64.tar.gz')
@@ -93,7 +192,7 @@ class NameTest(TestCase):
         self.assertEqual((4, None, None), d.parse_version('v4'))
         self.assertEqual((5, 12, None), d.parse_version('5.12'))
         self.assertEqual((6, 11, 0), d.parse_version('v6.11.0'))
-        self.assertRaisesRegexp(
+        self.assertRaisesRegex(
             ValueError,
             r"Invalid version '6.11.0.0', it does not match regex ",
             d.parse_version, '6.11.0.0')
@@ -154,6 +253,31 @@ class DownloadTest(TestCase):
         with d.download_package(data_dir('local-index/node-v8.1.2-linux-arm64.tar.gz')) as filename:
             self.assertEqual(data_dir('cache/node-v8.1.2-linux-arm64.tar.gz'), filename)
 
+    def test_download_local_package_link(self):
+        with temp_dir() as dirname:
+            package_file = osp.join(dirname, 'node-v8.1.2-linux-x64.tar.gz')
+            touch(package_file)
+            os.utime(package_file, (0, 0))
+            d = Damnode()
+            d.cache_dir = osp.join(dirname, 'cache')
+
+            for _ in range(2):
+                with d.download_package(package_file) as filename:
+                    self.assertTrue(osp.samefile(package_file, filename))
+                    self.assertEqual(0, osp.getmtime(filename))
+
+    def test_download_read_only_cached_package(self):
+        with temp_dir() as cache_dir:
+            cached_file = osp.join(cache_dir, 'node-v8.1.2-linux-x64.tar.gz')
+            touch(cached_file)
+            d = Damnode()
+            d.cache_dir = cache_dir
+
+            # Cache owned by another user, times cannot be set
+            with mock.patch('os.utime', side_effect=PermissionError(1, 'Operation not permitted')), \
+                    d.download_package('node-v8.1.2-linux-x64.tar.gz') as filename:
+                self.assertEqual(cached_file, filename)
+
     def test_download_remote_package(self):
         d = create_damnode()
         url = 'https://nodejs.org/dist/latest-v6.x/node-v6.11.0-win-x64.zip'
@@ -206,12 +330,80 @@ class DownloadTest(TestCase):
         self.assertEqual(unused_cache_dir, d.cache_dir)
         self.assertFalse(osp.exists(unused_cache_dir))
 
+    def test_download_package_parallel(self):
+        with temp_dir() as cache_dir:
+            d = Damnode()
+            d.cache_dir = cache_dir
+            d.parallel_download = True
+            d.parallel_min_size = 0
+            d.max_workers = 3
+            content = bytearray(range(256)) * 100
+            shasums = '{}  node-v8.1.2-linux-x64.tar.gz\n'.format(hashlib.sha256(content).hexdigest())
+            d._session = FakeRangeSession(bytes(content), shasums)
+            url = 'https://nodejs.org/dist/v8.1.2/node-v8.1.2-linux-x64.tar.gz'
+
+            with mock.patch('damnode.core.preallocate') as preallocate, \
+                    d.download_package(url) as filename:
+                with open(filename, 'rb') as f:
+                    self.assertEqual(content, f.read())
+
+            self.assertEqual(3, len(d._session.ranges))
+            self.assertIn(len(content), [args[1] for args, _ in preallocate.call_args_list])
+
+    def test_download_package_checksum_mismatch(self):
+        with temp_dir() as cache_dir:
+            d = Damnode()
+            d.cache_dir = cache_dir
+            d._session = FakeSession([
+                FakeResponse(200, '{}  node-v8.1.2-linux-x64.tar.gz\n'.format('0' * 64)),
+                FakeResponse(200, content=b'not node'),
+            ])
+            url = 'https://nodejs.org/dist/v8.1.2/node-v8.1.2-linux-x64.tar.gz'
+
+            with self.assertRaisesRegex(ValueError, r'^Checksum mismatch for'):
+                with d.download_package(url):
+                    pass
+
+            self.assertEqual([], os.listdir(cache_dir))
+
+    def test_download_package_preallocated(self):
+        with temp_dir() as cache_dir:
+            d = Damnode()
+            d.cache_dir = cache_dir
+            d.verify_checksum = False
+            # Content-Length overstates the body, the preallocated tail must go
+            d._session = FakeSession([
+                FakeResponse(200, headers={'content-length': '100'}, content=b'node'),
+            ])
+            url = 'https://nodejs.org/dist/v8.1.2/node-v8.1.2-linux-x64.tar.gz'
+
+            with d.download_package(url) as filename:
+                with open(filename, 'rb') as f:
+                    self.assertEqual(b'node', f.read())
+
+    def test_prune_cache(self):
+        with temp_dir() as cache_dir:
+            names = ['node-v6.0.0-linux-x64.tar.gz', 'node-v7.0.0-linux-x64.tar.gz',
+                     'node-v8.0.0-linux-x64.tar.gz', 'notes.txt']
+
+            for i, name in enumerate(names):
+                with open(osp.join(cache_dir, name), 'wb') as f:
+                    f.write(b'0' * 10)
+
+                os.utime(osp.join(cache_dir, name), (i, i))
+
+            d = Damnode()
+            d.cache_dir = cache_dir
+            d.max_cache_size = 15
+            d.prune_cache(osp.join(cache_dir, names[0]))
+            self.assertEqual([names[0], names[3]], sorted(os.listdir(cache_dir)))
+
 
 class InstallTest(TestCase):
     def test_install_wrong_system(self):
         with temp_dir() as prefix:
             url = 'https://nodejs.org/dist/latest-v8.x/node-v8.1.2-aix-ppc64.tar.gz'
-            self.assertRaisesRegexp(
+            self.assertRaisesRegex(
                 ValueError,
                 r"Package '.*/node-v8.1.2-aix-ppc64.tar.gz' is for aix-ppc64, not for current .*",
                 self.download_install, url, prefix, True)
@@ -233,6 +425,203 @@ class InstallTest(TestCase):
             self.assertTrue(osp.isdir(osp.join(prefix, 'node_modules')))
             self.assertTrue(osp.isfile(osp.join(prefix, 'node.exe')))
 
+    def test_install_tgz_stream(self):
+        with temp_dir() as prefix, temp_dir() as work_dir:
+            name = 'node-v8.1.2-linux-x64.tar.gz'
+            package_file = create_package(work_dir, name, ['bin/node', 'README.md'])
+            d = Damnode()
+            d.prefix = prefix
+
+            with open(package_file, 'rb') as f:
+                d.install_package(name, NonSeekableReader(f))
+
+            self.assertTrue(osp.isfile(osp.join(prefix, 'bin/node')))
+            self.assertFalse(osp.exists(osp.join(prefix, 'README.md')))
+
+    def test_install_win_zip_stream(self):
+        with temp_dir() as prefix, temp_dir() as work_dir:
+            name = 'node-v8.1.2-win-x64.zip'
+            package_file = create_package(work_dir, name, ['node.exe', 'README.md'])
+            d = Damnode()
+            d.prefix = prefix
+
+            with open(package_file, 'rb') as f:
+                d.install_package(name, NonSeekableReader(f))
+
+            self.assertTrue(osp.isfile(osp.join(prefix, 'node.exe')))
+            self.assertFalse(osp.exists(osp.join(prefix, 'README.md')))
+
+    def test_install_tgz_stream_isal(self):
+        with temp_dir() as prefix, temp_dir() as work_dir:
+            name = 'node-v8.1.2-linux-x64.tar.gz'
+            package_file = create_package(work_dir, name, ['bin/node', 'README.md'])
+            d = Damnode()
+            d.prefix = prefix
+            igzip = FakeIGzip()
+
+            with mock.patch('damnode.core.igzip', igzip), open(package_file, 'rb') as f:
+                d.install_package(name, NonSeekableReader(f))
+
+            self.assertEqual(1, len(igzip.files))
+            self.assertTrue(osp.isfile(osp.join(prefix, 'bin/node')))
+            self.assertFalse(osp.exists(osp.join(prefix, 'README.md')))
+
+    def test_install_tgz_isal(self):
+        with temp_dir() as prefix, temp_dir() as work_dir:
+            package_file = create_package(work_dir, 'node-v8.1.2-linux-x64.tar.gz', ['bin/node'])
+            d = Damnode()
+            d.prefix = prefix
+            igzip = FakeIGzip()
+
+            # Package on disk is opened and streamed through isal
+            with mock.patch('damnode.core.rapidgzip', None), mock.patch('damnode.core.igzip', igzip):
+                d.install_package(package_file)
+
+            self.assertEqual(1, len(igzip.files))
+            self.assertEqual(package_file, igzip.files[0].name)
+            self.assertTrue(osp.isfile(osp.join(prefix, 'bin/node')))
+
+    def test_install_tgz_rapidgzip(self):
+        with temp_dir() as prefix, temp_dir() as work_dir:
+            package_file = create_package(work_dir, 'node-v8.1.2-linux-x64.tar.gz', ['bin/node'])
+            d = Damnode()
+            d.prefix = prefix
+            rapidgzip = FakeRapidgzip()
+
+            with mock.patch('damnode.core.igzip', None), mock.patch('damnode.core.rapidgzip', rapidgzip):
+                # Too small to be worth the threads
+                d.rapidgzip_min_size = osp.getsize(package_file) + 1
+                d.install_package(package_file)
+                self.assertEqual([], rapidgzip.files)
+
+                d.rapidgzip_min_size = osp.getsize(package_file)
+                d.install_package(package_file)
+                self.assertEqual([package_file], rapidgzip.files)
+
+            self.assertTrue(osp.isfile(osp.join(prefix, 'bin/node')))
+
+    def test_stream_install_tgz_cache(self):
+        with temp_dir() as prefix, temp_dir() as cache_dir:
+            name = 'node-v8.1.2-linux-x64.tar.gz'
+            package_file = create_package(cache_dir, name, ['bin/node'])
+
+            with open(package_file, 'rb') as f:
+                content = f.read()
+
+            os.remove(package_file)
+            d = Damnode()
+            d.prefix = prefix
+            d.cache_dir = cache_dir
+            d._session = FakeSession([
+                FakeResponse(404),  # SHASUMS256.txt
+                FakeResponse(200, content=content),
+            ])
+            d.download_install_package('https://nodejs.org/dist/v8.1.2/' + name)
+            self.assertTrue(osp.isfile(osp.join(prefix, 'bin/node')))
+
+            with open(osp.join(cache_dir, name), 'rb') as f:
+                self.assertEqual(content, f.read())
+
+    def test_stream_install_checksum_mismatch(self):
+        with temp_dir() as prefix, temp_dir() as cache_dir:
+            name = 'node-v8.1.2-linux-x64.tar.gz'
+            package_file = create_package(cache_dir, name, ['bin/node'])
+
+            with open(package_file, 'rb') as f:
+                content = f.read()
+
+            os.remove(package_file)
+            node_file = osp.join(prefix, 'bin', 'node')
+            touch(node_file)
+            d = Damnode()
+            d.prefix = prefix
+            d.cache_dir = cache_dir
+            d._session = FakeSession([
+                FakeResponse(200, '{}  {}\n'.format('0' * 64, name)),
+                FakeResponse(200, content=content),
+            ])
+
+            with self.assertRaisesRegex(ValueError, r'^Checksum mismatch for'):
+                d.download_install_package('https://nodejs.org/dist/v8.1.2/' + name)
+
+            self.assertEqual(['bin'], os.listdir(prefix))
+            self.assertEqual(0, osp.getsize(node_file))
+            self.assertEqual([], os.listdir(cache_dir))
+
+    def test_stream_install_connection_error(self):
+        with temp_dir() as prefix, temp_dir() as cache_dir:
+            d = Damnode()
+            d.prefix = prefix
+            d.cache_dir = cache_dir
+            d.verify_checksum = False
+            d._session = FakeSession([IOError('Connection refused')])
+
+            with open(d.installed_file, 'w') as f:
+                f.write('node-v8.1.1-linux-x64.tar.gz')
+
+            with self.assertRaisesRegex(IOError, r'^Connection refused'):
+                d.download_install_package('https://nodejs.org/dist/v8.1.2/node-v8.1.2-linux-x64.tar.gz')
+
+            # Previous install is still intact
+            self.assertEqual([], os.listdir(cache_dir))
+            self.assertEqual(['.damnode-version'], os.listdir(prefix))
+            self.assertEqual('node-v8.1.1-linux-x64.tar.gz', d.get_installed_package())
+
+    def test_stream_install_incomplete(self):
+        with temp_dir() as prefix, temp_dir() as cache_dir:
+            name = 'node-v8.1.2-linux-x64.tar.gz'
+            files = ['bin/node'] + ['lib/{}'.format(i) for i in range(50)]
+            package_file = create_package(cache_dir, name, files)
+
+            with open(package_file, 'rb') as f:
+                content = f.read()
+
+            os.remove(package_file)
+            node_file = osp.join(prefix, 'bin', 'node')
+            touch(node_file)
+            d = Damnode()
+            d.prefix = prefix
+            d.cache_dir = cache_dir
+            # Connection dropped halfway through the body
+            headers = {'content-length': str(len(content))}
+            d._session = FakeSession([
+                FakeResponse(404),  # SHASUMS256.txt
+                FakeResponse(200, headers=headers, content=content[:len(content) // 2]),
+            ])
+
+            with self.assertRaisesRegex(ValueError, r'^Incomplete download of'):
+                d.download_install_package('https://nodejs.org/dist/v8.1.2/' + name)
+
+            self.assertEqual(['bin'], os.listdir(prefix))
+            self.assertEqual(0, osp.getsize(node_file))
+            self.assertEqual([], os.listdir(cache_dir))
+
+    def test_install_already_installed(self):
+        with temp_dir() as prefix, temp_dir() as work_dir:
+            name = 'node-v8.1.2-linux-x64.tar.gz'
+            package_file = create_package(work_dir, name, ['bin/node'])
+            d = Damnode()
+            d._system = 'linux'  # cached property values
+            d._architecture = 'x64'
+            d.prefix = prefix
+            d.cache_dir = osp.join(work_dir, 'cache')
+            d.install(package_file)
+            self.assertEqual(name, d.get_installed_package())
+            self.assertTrue(osp.isfile(osp.join(prefix, 'bin', 'node')))
+
+            # Neither the package nor the index is touched again
+            installed = []
+            d.download_install_package = installed.append
+            d._session = FakeSession([])
+            d.install(package_file)
+            d.install('v8.1.2')
+            self.assertEqual([], installed)
+            self.assertEqual([], d._session.requests)
+
+            d.force = True
+            d.install(package_file)
+            self.assertEqual([package_file], installed)
+
     def download_install(self, url, prefix, check_sys_arch=False):
         d = Damnode()
         d.prefix = prefix
@@ -252,8 +641,11 @@ class TestDamnode(Damnode):
         self.cache_dir = data_dir('cache')
 
 
+_test_data_dir = osp.abspath(osp.join(osp.dirname(__file__), 'test.d'))
+
+
 def data_dir(*path):
-    return osp.abspath(osp.join(osp.dirname(__file__), 'test.d', *path))
+    return osp.join(_test_data_dir, *path)
 
 
 def create_damnode():
@@ -263,6 +655,120 @@ def create_damnode():
     return d
 
 
+def touch(filename):
+    dirname = osp.dirname(filename)
+
+    if not osp.isdir(dirname):
+        os.makedirs(dirname)
+
+    open(filename, 'w').close()
+
+
+def create_package(dirname, name, files):
+    package_file = osp.join(dirname, name)
+    base_dir = name[:-len('.zip')] if name.endswith('.zip') else name[:-len('.tar.gz')]
+
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(package_file, 'w') as ar:
+            for filename in files:
+                ar.writestr('/'.join([base_dir, filename]), filename)
+    else:
+        with tarfile.open(package_file, 'w:gz') as ar:
+            for filename in files:
+                data = filename.encode('utf-8')
+                info = tarfile.TarInfo('/'.join([base_dir, filename]))
+                info.size = len(data)
+                ar.addfile(info, io.BytesIO(data))
+
+    return package_file
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, text='', headers=None, content=b''):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = text
+        self.headers = headers or {}
+        self.content = content or text.encode('utf-8')
+        self.raw = io.BytesIO(content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise ValueError('HTTP {}'.format(self.status_code))
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append(dict(kwargs, url=url))
+        response = self.responses.pop(0)
+
+        if isinstance(response, Exception):
+            raise response
+
+        return response
+
+
+class FakeRangeSession(object):
+    def __init__(self, content, shasums=''):
+        self.content = content
+        self.shasums = shasums
+        self.ranges = []
+
+    def head(self, url, **kwargs):
+        headers = {'content-length': str(len(self.content)), 'accept-ranges': 'bytes'}
+        return FakeResponse(200, headers=headers)
+
+    def get(self, url, headers=None, **kwargs):
+        if url.endswith('/SHASUMS256.txt'):
+            return FakeResponse(200, self.shasums)
+
+        start, end = [int(i) for i in headers['Range'][len('bytes='):].split('-')]
+        self.ranges.append((start, end))
+        return FakeResponse(206, content=self.content[start:end + 1])
+
+
+class FakeIGzip(object):
+    # Stand-in for isal.igzip
+    def __init__(self):
+        self.files = []
+
+    def IGzipFile(self, fileobj, mode):
+        self.files.append(fileobj)
+        return gzip.GzipFile(fileobj=fileobj, mode=mode)
+
+
+class FakeRapidgzip(object):
+    # Stand-in for the rapidgzip module
+    def __init__(self):
+        self.files = []
+
+    def open(self, filename, parallelization):
+        self.files.append(filename)
+        return gzip.open(filename, 'rb')
+
+
+class NonSeekableReader(object):
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        return self.fileobj.read(size)
+
+    def readinto(self, buf):
+        return self.fileobj.readinto(buf)
+
+
 @contextmanager
 def temp_dir(clean=True):
     dirname = tempfile.mkdtemp()